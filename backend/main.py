@@ -1,14 +1,23 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query
+from fastapi import FastAPI, HTTPException, Request, Response, UploadFile, File, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import datetime
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import asyncio
+import hashlib
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
+import aiofiles
+import orjson
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
 from bson import ObjectId
 from pymongo import ReturnDocument
+from redis.asyncio import Redis
 import logging
 from uuid import uuid4
+from starlette.middleware.gzip import GZipMiddleware
 from starlette.staticfiles import StaticFiles
 
 # ---------- Logging ----------
@@ -16,19 +25,25 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("notes-api")
 
 
-# ---------- Pydantic helpers ----------
-class PyObjectId(ObjectId):
-    @classmethod
-    def __get_validators__(cls):
-        yield cls.validate
+# ---------- ObjectId helpers ----------
+def _oid(s: str) -> ObjectId:
+    """Parse a 24-hex path param into an ObjectId on the fast path.
 
-    @classmethod
-    def validate(cls, v):
-        if isinstance(v, ObjectId):
-            return v
-        if not ObjectId.is_valid(v):
-            raise ValueError("Invalid ObjectId")
-        return ObjectId(v)
+    bytes.fromhex runs in C and the bytes constructor skips ObjectId's
+    regex-based is_valid scan, so well-formed ids pay no Python-level work.
+    """
+    # bytes.fromhex tolerates embedded spaces, so require the canonical
+    # 24-char form up front; cache keys use the raw string, so aliases for
+    # the same id must not parse.
+    if len(s) != 24:
+        raise HTTPException(status_code=400, detail="Invalid note id")
+    try:
+        raw = bytes.fromhex(s)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid note id")
+    if len(raw) != 12:
+        raise HTTPException(status_code=400, detail="Invalid note id")
+    return ObjectId(raw)
 
 
 # ---------- Schemas ----------
@@ -47,33 +62,42 @@ class NoteUpdate(BaseModel):
     content: Optional[str] = None
 
 
-class NoteOut(NoteBase):
-    id: PyObjectId = Field(alias="_id")
+@dataclass(slots=True)
+class NoteOut:
+    """Shape of a note response.
+
+    A plain dataclass rather than a pydantic model: responses are raw Mongo
+    docs serialized by orjson, so no validator chain runs on the way out.
+    """
+
+    id: str
+    title: str
+    content: str
+    images: List[str]
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        json_encoders = {ObjectId: str}
-        populate_by_name = True
 
+# ---------- JSON serialization ----------
+def _json_default(obj):
+    """orjson fallback for BSON types (ObjectId -> str); datetimes are native."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj)}")
 
-# ---------- App ----------
-app = FastAPI(title="Notes API", version="1.0.0")
 
-# CORS for local Next.js dev
-FRONTEND_ORIGIN = os.environ.get("FRONTEND_ORIGIN", "http://localhost:3000")
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[FRONTEND_ORIGIN, "http://localhost:3000", "http://127.0.0.1:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# pymongo hands back naive UTC datetimes while freshly built docs carry
+# tz-aware ones; OPT_NAIVE_UTC makes both serialize with an explicit +00:00
+# so clients never mistake a timestamp for local time.
+_ORJSON_OPTS = orjson.OPT_NAIVE_UTC
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """ORJSONResponse that serializes raw MongoDB docs without a Python-level pass."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_json_default, option=_ORJSON_OPTS)
 
-# ---------- Static files (uploads) ----------
-UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(os.path.dirname(__file__), "uploads"))
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 # ---------- Database Config ----------
 MONGO_USER = os.environ.get("MONGO_USER", "admin")
@@ -89,32 +113,138 @@ MONGODB_URI = os.environ.get(
 )
 
 mongo_client: Optional[AsyncIOMotorClient] = None
+# Resolved once at startup; saves two __getitem__ dispatches per use in routes.
+notes_coll: Optional[AsyncIOMotorCollection] = None
 
+# ---------- Cache Config ----------
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", "30"))
+
+redis_client: Optional[Redis] = None
+
+
+async def _cache_get(key: str) -> Optional[bytes]:
+    if redis_client is None:
+        return None
+    try:
+        return await redis_client.get(key)
+    except Exception as e:
+        logger.warning(f"Redis get failed for {key}: {e}")
+        return None
+
+
+async def _cache_set(key: str, value: bytes) -> None:
+    if redis_client is None:
+        return
+    try:
+        await redis_client.setex(key, CACHE_TTL_SECONDS, value)
+    except Exception as e:
+        logger.warning(f"Redis set failed for {key}: {e}")
+
+
+async def _cache_invalidate(*keys: str) -> None:
+    if redis_client is None:
+        return
+    try:
+        await redis_client.delete(*keys)
+    except Exception as e:
+        logger.warning(f"Redis delete failed for {keys}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global mongo_client, notes_coll, redis_client
+    # Request validation leans on pydantic-core's compiled (Rust) extension;
+    # a pure-Python fallback build would silently cost ~an order of magnitude
+    # on every POST/PUT, so flag it loudly if that's what got installed.
+    # Diagnostics only — never let the probe itself break startup.
+    try:
+        import pydantic_core._pydantic_core as _pc
+
+        if not _pc.__file__.endswith((".so", ".pyd")):
+            logger.warning(
+                f"pydantic-core is not a compiled build ({_pc.__file__}); "
+                "request validation will be slow"
+            )
+    except ImportError:
+        logger.warning("Could not inspect pydantic-core build; skipping compiled-build check")
 
-@app.on_event("startup")
-async def startup_event():
-    global mongo_client
     try:
         logger.info("Connecting to MongoDB...")
-        mongo_client = AsyncIOMotorClient(MONGODB_URI)
-        await mongo_client.admin.command("ping")
+        # minPoolSize pre-warms connections so the first requests after boot
+        # don't pay the lazy-connect penalty; wire compression trims the
+        # text-heavy content field on the Mongo leg when zstd is available.
+        mongo_client = AsyncIOMotorClient(
+            MONGODB_URI,
+            maxPoolSize=50,
+            minPoolSize=10,
+            serverSelectionTimeoutMS=3000,
+            connectTimeoutMS=2000,
+            compressors="zstd,snappy",
+        )
+        notes_coll = mongo_client[MONGO_DB]["notes"]
+        # Independent round trips overlap, so startup costs max-of-ops rather
+        # than sum-of-ops: ping, the list-sort index, and the text index for
+        # /notes/search all go out together.
+        await asyncio.gather(
+            mongo_client.admin.command("ping"),
+            notes_coll.create_index(
+                [("updated_at", -1), ("_id", -1)], name="updated_at_desc"
+            ),
+            notes_coll.create_index(
+                [("title", "text"), ("content", "text")], name="note_text"
+            ),
+        )
         logger.info(f"✅ Connected to MongoDB at {MONGO_HOST}:{MONGO_PORT}, DB: {MONGO_DB}")
     except Exception as e:
         logger.error(f"❌ Could not connect to MongoDB: {e}")
         raise e
 
+    # Cache is best-effort: the app serves straight from Mongo if Redis is down.
+    try:
+        redis_client = Redis.from_url(REDIS_URL)
+        await redis_client.ping()
+        logger.info(f"✅ Connected to Redis at {REDIS_URL}")
+    except Exception as e:
+        logger.warning(f"Redis unavailable, caching disabled: {e}")
+        redis_client = None
+
+    yield
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    global mongo_client
     if mongo_client is not None:
         logger.info("Closing MongoDB connection...")
         mongo_client.close()
+    if redis_client is not None:
+        logger.info("Closing Redis connection...")
+        await redis_client.aclose()
+
+
+# ---------- App ----------
+app = FastAPI(
+    title="Notes API",
+    version="1.0.0",
+    default_response_class=MongoJSONResponse,
+    lifespan=lifespan,
+)
+
+# CORS for local Next.js dev
+FRONTEND_ORIGIN = os.environ.get("FRONTEND_ORIGIN", "http://localhost:3000")
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[FRONTEND_ORIGIN, "http://localhost:3000", "http://127.0.0.1:3000"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
+# Note JSON compresses well (repeated field names, natural text); small
+# responses are left alone so compression never costs more than it saves.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
-def notes_collection():
-    assert mongo_client is not None, "Mongo client not initialized"
-    return mongo_client[MONGO_DB]["notes"]
+# ---------- Static files (uploads) ----------
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(os.path.dirname(__file__), "uploads"))
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 
 # ---------- Routes ----------
@@ -125,11 +255,35 @@ async def health():
 
 @app.get("/notes")
 async def list_notes(
+    request: Request,
     q: Optional[str] = Query(default=None, description="Search in title/content"),
     date_from: Optional[str] = Query(default=None, description="Start date YYYY-MM-DD (created_at)"),
     date_to: Optional[str] = Query(default=None, description="End date YYYY-MM-DD (created_at)"),
+    fields: Optional[str] = Query(default=None, description="Comma-separated fields to return (e.g. title,updated_at)"),
 ):
     try:
+        # Weak ETag from the newest updated_at plus the collection size: any
+        # note mutation moves one of the two, and both probes ride the
+        # updated_at index / collection metadata, so this is O(1) per request.
+        max_doc = await notes_coll.find_one(
+            {}, projection={"updated_at": 1}, sort=[("updated_at", -1)]
+        )
+        count = await notes_coll.estimated_document_count()
+        stamp = int(max_doc["updated_at"].timestamp() * 1000) if max_doc else 0
+        etag = f'W/"{stamp}-{count}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304)
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=5"}
+
+        # Only the plain, unfiltered list is cached; it is what the index page
+        # polls. Cached value is the final serialized body, so hits skip Mongo
+        # and serialization entirely.
+        cacheable = not (q or date_from or date_to or fields)
+        if cacheable:
+            cached = await _cache_get("notes:list")
+            if cached is not None:
+                return Response(content=cached, media_type="application/json", headers=headers)
+
         filters: dict = {}
         # text search
         if q:
@@ -156,25 +310,105 @@ async def list_notes(
             if range_q:
                 filters["created_at"] = range_q
 
-        cursor = notes_collection().find(filters, sort=[("updated_at", -1)])
-        items = [doc async for doc in cursor]
-        # Convert ObjectId to string for JSON serialization
-        for item in items:
-            item["_id"] = str(item["_id"])
-        return items
+        # Optional projection so list clients can skip heavy fields (e.g. the
+        # content body) and keep response bytes proportional to N, not text.
+        projection = None
+        if fields:
+            projection = {f: 1 for f in (s.strip() for s in fields.split(",")) if f}
+            # Client input goes straight into the projection document; an
+            # operator-looking key would bubble up from Mongo as a 500.
+            if any(f.startswith("$") for f in projection):
+                raise HTTPException(status_code=400, detail="Invalid field name in fields")
+        cursor = notes_coll.find(
+            filters, projection=projection, sort=[("updated_at", -1)]
+        )
+        # One getMore per ~200 docs; stream each batch to the client as it
+        # arrives instead of materializing the whole list in memory first.
+        cursor.batch_size(200)
+
+        async def gen():
+            # Buffer a copy only when this response feeds the cache; filtered
+            # or projected requests stream in O(1) memory.
+            chunks: Optional[List[bytes]] = [b"["] if cacheable else None
+            yield b"["
+            first = True
+            async for doc in cursor:
+                if not first:
+                    if chunks is not None:
+                        chunks.append(b",")
+                    yield b","
+                first = False
+                body = orjson.dumps(doc, default=_json_default, option=_ORJSON_OPTS)
+                if chunks is not None:
+                    chunks.append(body)
+                yield body
+            yield b"]"
+            if chunks is not None:
+                chunks.append(b"]")
+                await _cache_set("notes:list", b"".join(chunks))
+
+        return StreamingResponse(gen(), media_type="application/json", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching notes: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch notes")
 
 
+# NOTE: declared before /notes/{note_id} so "search" isn't captured as an id.
+@app.get("/notes/search")
+async def search_notes(
+    q: str = Query(..., min_length=1, description="Full-text search query"),
+    limit: int = Query(default=50, ge=1, le=200),
+):
+    try:
+        # Push match/sort/limit down to Mongo's text index; content is
+        # projected away since search results only need the summary fields.
+        cursor = notes_coll.aggregate(
+            [
+                {"$match": {"$text": {"$search": q}}},
+                {"$sort": {"score": {"$meta": "textScore"}}},
+                {"$limit": limit},
+                {"$project": {"content": 0}},
+            ]
+        )
+
+        async def gen():
+            yield b"["
+            first = True
+            async for doc in cursor:
+                if not first:
+                    yield b","
+                first = False
+                yield orjson.dumps(doc, default=_json_default, option=_ORJSON_OPTS)
+            yield b"]"
+
+        return StreamingResponse(gen(), media_type="application/json")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching notes: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search notes")
+
+
 @app.get("/notes/{note_id}")
 async def get_note(note_id: str):
     try:
-        note = await notes_collection().find_one({"_id": PyObjectId.validate(note_id)})
+        # Key the cache on the canonical lowercase id: _oid accepts mixed-case
+        # hex, and aliased keys would dodge mutation invalidation.
+        oid = _oid(note_id)
+        key = f"notes:{oid}"
+        cached = await _cache_get(key)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+        note = await notes_coll.find_one({"_id": oid})
         if not note:
             raise HTTPException(status_code=404, detail="Note not found")
-        note["_id"] = str(note["_id"])
-        return note
+        body = orjson.dumps(note, default=_json_default, option=_ORJSON_OPTS)
+        await _cache_set(key, body)
+        return Response(content=body, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching note {note_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch note")
@@ -183,35 +417,62 @@ async def get_note(note_id: str):
 @app.post("/notes", status_code=201)
 async def create_note(payload: NoteCreate):
     try:
-        now = datetime.utcnow()
+        now = datetime.now(timezone.utc)
         doc = {"title": payload.title, "content": payload.content, "images": payload.images or [], "created_at": now, "updated_at": now}
-        result = await notes_collection().insert_one(doc)
-        created = await notes_collection().find_one({"_id": result.inserted_id})
-        if created:
-            created["_id"] = str(created["_id"])
-        return created
+        result = await notes_coll.insert_one(doc)
+        # We already hold the full document locally; no need to re-fetch it.
+        doc["_id"] = result.inserted_id
+        await _cache_invalidate("notes:list")
+        return MongoJSONResponse(doc, status_code=201)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating note: {e}")
         raise HTTPException(status_code=500, detail="Failed to create note")
 
 
+@app.post("/notes/batch", status_code=201)
+async def create_notes_batch(payload: List[NoteCreate]):
+    try:
+        if not payload:
+            return MongoJSONResponse({"inserted_ids": []}, status_code=201)
+        # One timestamp and one unordered insert_many for the whole batch:
+        # write overhead is amortized across N docs instead of N round trips.
+        now = datetime.now(timezone.utc)
+        docs = [
+            {"title": p.title, "content": p.content, "images": p.images or [], "created_at": now, "updated_at": now}
+            for p in payload
+        ]
+        result = await notes_coll.insert_many(docs, ordered=False)
+        await _cache_invalidate("notes:list")
+        return MongoJSONResponse({"inserted_ids": result.inserted_ids}, status_code=201)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating notes batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create notes")
+
+
 @app.put("/notes/{note_id}")
 async def update_note(note_id: str, payload: NoteUpdate):
     try:
-        update_data = {k: v for k, v in payload.model_dump(exclude_unset=True).items()}
-        if not update_data:
-            # force an update to touch updated_at
-            update_data = {}
-        update = {"$set": {**update_data, "updated_at": datetime.utcnow()}}
-        result = await notes_collection().find_one_and_update(
-            {"_id": PyObjectId.validate(note_id)},
+        # Single pass over the fields the client actually sent, instead of
+        # model_dump building a dict we then copy; an empty set still updates
+        # updated_at, which is the intended "touch" behavior.
+        oid = _oid(note_id)
+        update_data = {k: getattr(payload, k) for k in payload.__pydantic_fields_set__}
+        update = {"$set": {**update_data, "updated_at": datetime.now(timezone.utc)}}
+        result = await notes_coll.find_one_and_update(
+            {"_id": oid},
             update,
             return_document=ReturnDocument.AFTER,
         )
         if not result:
             raise HTTPException(status_code=404, detail="Note not found")
-        result["_id"] = str(result["_id"])
-        return result
+        await _cache_invalidate("notes:list", f"notes:{oid}")
+        return MongoJSONResponse(result)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating note {note_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to update note")
@@ -220,17 +481,22 @@ async def update_note(note_id: str, payload: NoteUpdate):
 @app.delete("/notes/{note_id}", status_code=204)
 async def delete_note(note_id: str):
     try:
-        result = await notes_collection().delete_one({"_id": PyObjectId.validate(note_id)})
+        oid = _oid(note_id)
+        result = await notes_coll.delete_one({"_id": oid})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Note not found")
+        await _cache_invalidate("notes:list", f"notes:{oid}")
         return None
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error deleting note {note_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to delete note")
 
 
 # ---------- Image upload/delete ----------
-ALLOWED_MIME = {"image/jpeg", "image/png", "image/webp"}
+_MIME_EXT = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp"}
+ALLOWED_MIME = frozenset(_MIME_EXT)
 MAX_FILES_PER_NOTE = int(os.environ.get("MAX_FILES_PER_NOTE", "5"))
 MAX_FILE_SIZE_MB = int(os.environ.get("MAX_FILE_SIZE_MB", "5"))
 
@@ -238,46 +504,91 @@ MAX_FILE_SIZE_MB = int(os.environ.get("MAX_FILE_SIZE_MB", "5"))
 @app.post("/notes/{note_id}/images")
 async def upload_images(note_id: str, files: List[UploadFile] = File(...)):
     try:
-        note = await notes_collection().find_one({"_id": PyObjectId.validate(note_id)})
-        if not note:
-            raise HTTPException(status_code=404, detail="Note not found")
-
-        existing_images: List[str] = note.get("images", [])
-        remaining_slots = MAX_FILES_PER_NOTE - len(existing_images)
-        if remaining_slots <= 0:
+        oid = _oid(note_id)
+        if len(files) > MAX_FILES_PER_NOTE:
             raise HTTPException(status_code=400, detail="Image limit reached for this note")
 
-        to_process = files[:remaining_slots]
-        saved_urls: List[str] = []
-
-        for f in to_process:
+        # Validate every content type before any bytes hit disk, so a bad
+        # file later in the batch can't leave earlier ones orphaned.
+        for f in files:
             if f.content_type not in ALLOWED_MIME:
                 raise HTTPException(status_code=400, detail=f"Unsupported type: {f.content_type}")
-            # size check by reading into memory in chunks
-            data = await f.read()
-            size_mb = len(data) / (1024 * 1024)
-            if size_mb > MAX_FILE_SIZE_MB:
+
+        saved_urls: List[str] = []
+        created_paths: List[str] = []
+
+        max_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+        for f in files:
+            ext = _MIME_EXT[f.content_type]
+            # Stream chunks into a temp file while hashing; the final name is
+            # the content digest, so re-uploads of the same image land on the
+            # same file and cost no extra disk.
+            tmp_path = os.path.join(UPLOAD_DIR, f".{uuid4().hex}.tmp")
+            hasher = hashlib.blake2b(digest_size=16)
+            size = 0
+            too_large = False
+            async with aiofiles.open(tmp_path, "wb") as out:
+                while chunk := await f.read(64 * 1024):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        too_large = True
+                        break
+                    hasher.update(chunk)
+                    await out.write(chunk)
+            if too_large:
+                # Drop the partial temp file and any files this request
+                # already created, mirroring the rejected-update cleanup.
+                for p in [tmp_path] + created_paths:
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
                 raise HTTPException(status_code=400, detail=f"File too large (> {MAX_FILE_SIZE_MB} MB)")
-            ext = {
-                "image/jpeg": ".jpg",
-                "image/png": ".png",
-                "image/webp": ".webp",
-            }[f.content_type]
-            name = f"{uuid4().hex}{ext}"
+            name = f"{hasher.hexdigest()}{ext}"
             dest_path = os.path.join(UPLOAD_DIR, name)
-            with open(dest_path, "wb") as out:
-                out.write(data)
-            saved_urls.append(f"/uploads/{name}")
-
-        new_images = existing_images + saved_urls
-        updated = await notes_collection().find_one_and_update(
-            {"_id": PyObjectId.validate(note_id)},
-            {"$set": {"images": new_images, "updated_at": datetime.utcnow()}},
+            if os.path.exists(dest_path):
+                # duplicate content already on disk
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, dest_path)
+                created_paths.append(dest_path)
+            url = f"/uploads/{name}"
+            # Identical files in one request collapse to one entry, so the
+            # images array never carries (or counts) the same URL twice.
+            if url not in saved_urls:
+                saved_urls.append(url)
+
+        # Single atomic read-modify-write: the $expr guard enforces the image
+        # limit server-side, so concurrent uploads can't race past it, and the
+        # happy path costs one round trip instead of a find_one + update.
+        updated = await notes_coll.find_one_and_update(
+            {
+                "_id": oid,
+                "$expr": {
+                    "$lte": [
+                        {"$size": {"$ifNull": ["$images", []]}},
+                        MAX_FILES_PER_NOTE - len(saved_urls),
+                    ]
+                },
+            },
+            {"$push": {"images": {"$each": saved_urls}}, "$set": {"updated_at": datetime.now(timezone.utc)}},
             return_document=ReturnDocument.AFTER,
         )
-        assert updated is not None
-        updated["_id"] = str(updated["_id"])
-        return updated
+        if updated is None:
+            # Update rejected: drop only the files this request created (a
+            # deduped file may back another note), then figure out why
+            # (missing note vs. limit) on the error path only.
+            for p in created_paths:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            note = await notes_coll.find_one({"_id": oid}, projection={"_id": 1})
+            if not note:
+                raise HTTPException(status_code=404, detail="Note not found")
+            raise HTTPException(status_code=400, detail="Image limit reached for this note")
+        await _cache_invalidate("notes:list", f"notes:{oid}")
+        return MongoJSONResponse(updated)
     except HTTPException:
         raise
     except Exception as e:
@@ -288,31 +599,39 @@ async def upload_images(note_id: str, files: List[UploadFile] = File(...)):
 @app.delete("/notes/{note_id}/images")
 async def delete_image(note_id: str, url: str):
     try:
-        note = await notes_collection().find_one({"_id": PyObjectId.validate(note_id)})
+        oid = _oid(note_id)
+        # Only the images array is needed here; skip content and the rest of
+        # the doc so the read doesn't scale with note size.
+        note = await notes_coll.find_one({"_id": oid}, projection={"images": 1})
         if not note:
             raise HTTPException(status_code=404, detail="Note not found")
         images: List[str] = note.get("images", [])
         if url not in images:
             raise HTTPException(status_code=404, detail="Image not found on this note")
 
-        # remove file from disk if under /uploads
+        # remove file from disk if under /uploads, unless another note still
+        # references it (files are content-addressed and shared across notes)
         if url.startswith("/uploads/"):
             file_path = os.path.join(UPLOAD_DIR, os.path.basename(url))
             if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    logger.warning(f"Failed to remove file {file_path}: {e}")
+                others = await notes_coll.count_documents(
+                    {"_id": {"$ne": oid}, "images": url}, limit=1
+                )
+                if others == 0:
+                    try:
+                        os.remove(file_path)
+                    except Exception as e:
+                        logger.warning(f"Failed to remove file {file_path}: {e}")
 
         new_images = [i for i in images if i != url]
-        updated = await notes_collection().find_one_and_update(
-            {"_id": PyObjectId.validate(note_id)},
-            {"$set": {"images": new_images, "updated_at": datetime.utcnow()}},
+        updated = await notes_coll.find_one_and_update(
+            {"_id": oid},
+            {"$set": {"images": new_images, "updated_at": datetime.now(timezone.utc)}},
             return_document=ReturnDocument.AFTER,
         )
         assert updated is not None
-        updated["_id"] = str(updated["_id"])
-        return updated
+        await _cache_invalidate("notes:list", f"notes:{oid}")
+        return MongoJSONResponse(updated)
     except HTTPException:
         raise
     except Exception as e: